@@ -873,7 +873,8 @@ def get_project_configuration(dry_run):
         'PyQt5',
         # extra
         'scipy',
-        'Pillow']
+        'Pillow',
+        'numba']
 
     extras_require = {
         'full': full_requires,
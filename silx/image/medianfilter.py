@@ -24,15 +24,18 @@
 
 """
 This module provides :func:`medfilt2d`, a 2D median filter function
-with the choice between 2 implementations: 'cpp' and 'opencl'.
+with the choice between 3 implementations: 'cpp', 'opencl' and 'numba'.
 """
 
 __authors__ = ["H. Payno"]
 __license__ = "MIT"
-__date__ = "04/05/2017"
+__date__ = "15/10/2026"
 
 
 import logging
+import numbers
+
+import numpy
 
 from silx.math import medianfilter as medianfilter_cpp
 from silx.opencl import ocl as _ocl
@@ -41,14 +44,76 @@ if _ocl is not None:
 else:  # No OpenCL device or pyopencl not installed
     medfilt_opencl = None
 
-
-_logger = logging.getLogger(__name__)
+try:
+    import numba
+except ImportError:
+    numba = None
 
 
-MEDFILT_ENGINES = ['cpp', 'opencl']
+_logger = logging.getLogger(__name__)
 
 
-def medfilt2d(image, kernel_size=3, engine='cpp'):
+MEDFILT_ENGINES = ['cpp', 'opencl', 'numba']
+
+
+if numba is not None:
+    @numba.njit(["float32[:,:](float32[:,:], int64, int64, boolean)",
+                 "float64[:,:](float64[:,:], int64, int64, boolean)"],
+                parallel=True, cache=True)
+    def numba_medfilt2d(image, kernel_height, kernel_width, conditional):
+        """Median filter of a 2D image compiled with numba.
+
+        Behaves as :func:`silx.math.medianfilter.medfilt` in 'nearest' mode:
+        NaN values are ignored and, for an even number of valid values,
+        the highest of the 2 central values is taken.
+
+        :param numpy.ndarray image: 2D array of float32 or float64
+        :param int kernel_height: height of the kernel, an even size is
+            rounded down to the previous odd one as in the cpp implementation
+        :param int kernel_width: width of the kernel, an even size is
+            rounded down to the previous odd one as in the cpp implementation
+        :param bool conditional: True to only filter pixels which are
+            the minimum or the maximum of their window
+        :returns: the filtered array
+        """
+        height, width = image.shape
+        half_height = (kernel_height - 1) // 2
+        half_width = (kernel_width - 1) // 2
+        output = numpy.empty_like(image)
+        for y in numba.prange(height):
+            window = numpy.empty((2 * half_height + 1) * (2 * half_width + 1),
+                                 dtype=image.dtype)
+            for x in range(width):
+                # Insertion sort of the window, fast for small kernels
+                count = 0
+                for ky in range(y - half_height, y + half_height + 1):
+                    yy = min(max(ky, 0), height - 1)
+                    for kx in range(x - half_width, x + half_width + 1):
+                        xx = min(max(kx, 0), width - 1)
+                        value = image[yy, xx]
+                        if value != value:  # NaN are ignored
+                            continue
+                        pos = count
+                        while pos > 0 and window[pos - 1] > value:
+                            window[pos] = window[pos - 1]
+                            pos -= 1
+                        window[pos] = value
+                        count += 1
+
+                pixel = image[y, x]
+                if count == 0:
+                    output[y, x] = numpy.nan
+                elif (conditional and
+                        pixel != window[0] and pixel != window[count - 1]):
+                    output[y, x] = pixel
+                else:
+                    output[y, x] = window[count // 2]
+        return output
+else:  # numba not installed
+    numba_medfilt2d = None
+
+
+def medfilt2d(image, kernel_size=3, engine='cpp', ctx=None):
     """Apply a median filter on an image.
 
     This median filter is using a 'nearest' padding for values
@@ -65,11 +130,14 @@ def medfilt2d(image, kernel_size=3, engine='cpp'):
         Default: (3, 3)
     :type kernel_size: A int or a list of 2 int (kernel_height, kernel_width)
     :param engine: the type of implementation to use.
-        Valid values are: 'cpp' (default) and 'opencl'
+        Valid values are: 'cpp' (default), 'opencl' and 'numba'
+    :param ctx: OpenCL context to use with the 'opencl' engine,
+        by default a context is created on a GPU.
+    :type ctx: pyopencl.Context
 
     :returns: the array with the median value for each pixel.
 
-    .. note::  if the opencl implementation is requested but
+    .. note::  if the opencl or numba implementation is requested but
         is not present or fails, the cpp implementation is called.
 
     """
@@ -97,6 +165,7 @@ def medfilt2d(image, kernel_size=3, engine='cpp'):
         else:
             try:
                 medianfilter = medfilt_opencl.MedianFilter2D(image.shape,
+                                                             ctx=ctx,
                                                              devicetype="gpu")
                 res = medianfilter.medfilt2d(image, kernel_size)
             except(RuntimeError, MemoryError, ImportError):
@@ -112,3 +181,37 @@ def medfilt2d(image, kernel_size=3, engine='cpp'):
                                                conditional=False)
 
         return res
+    elif engine == 'numba':
+        if numba_medfilt2d is None:
+            wrn = 'numba median filter not available. '
+            wrn += 'Launching cpp implementation.'
+            _logger.warning(wrn)
+            # instead call the cpp implementation
+            return medianfilter_cpp.medfilt(data=image,
+                                            kernel_size=kernel_size,
+                                            conditional=False)
+        if image.dtype not in (numpy.float32, numpy.float64):
+            # integer types are kept by the cpp implementation
+            return medianfilter_cpp.medfilt(data=image,
+                                            kernel_size=kernel_size,
+                                            conditional=False)
+        if isinstance(kernel_size, numbers.Integral):
+            kernel_size = (kernel_size, kernel_size)
+        try:
+            res = numba_medfilt2d(numpy.ascontiguousarray(image),
+                                  int(kernel_size[0]),
+                                  int(kernel_size[1]),
+                                  False)
+        except(RuntimeError, MemoryError, TypeError):
+            wrn = 'Exception occured in numba median filter. '
+            wrn += 'To get more information see debug log.'
+            wrn += 'Launching cpp implementation.'
+            _logger.warning(wrn)
+            _logger.debug("median filter - numba implementation issue.",
+                          exc_info=True)
+            # instead call the cpp implementation
+            res = medianfilter_cpp.medfilt(data=image,
+                                           kernel_size=kernel_size,
+                                           conditional=False)
+
+        return res
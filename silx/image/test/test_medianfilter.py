@@ -28,7 +28,7 @@
 
 __authors__ = ["H. Payno"]
 __license__ = "MIT"
-__date__ = "11/05/2017"
+__date__ = "15/10/2026"
 
 import unittest
 from silx.image import medianfilter
@@ -36,32 +36,79 @@ import numpy
 
 from silx.opencl.common import ocl
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
 
 class TestMedianFilterEngines(unittest.TestCase):
     """Make sure we have access to all the different implementation of
     median filter from image medfilt"""
 
+    KERNEL = (1, 1)
 
-    IMG = numpy.arange(10000.).reshape(100, 100)
+    @classmethod
+    def setUpClass(cls):
+        cls.IMG = numpy.arange(10000.).reshape(100, 100)
+        # A single OpenCL context is shared by all tests
+        cls.ctx = ocl.create_context(devicetype="gpu") if ocl else None
 
-    KERNEL = (1, 1)
+    @classmethod
+    def tearDownClass(cls):
+        cls.IMG = None
+        cls.ctx = None
 
     def testCppMedFilt2d(self):
         """test cpp engine for medfilt2d"""
         res = medianfilter.medfilt2d(
-            image=TestMedianFilterEngines.IMG,
-            kernel_size=TestMedianFilterEngines.KERNEL,
+            image=self.IMG,
+            kernel_size=self.KERNEL,
             engine='cpp')
-        self.assertTrue(numpy.array_equal(res, TestMedianFilterEngines.IMG))
+        self.assertTrue(numpy.array_equal(res, self.IMG))
 
     @unittest.skipUnless(ocl, "PyOpenCl is missing")
     def testOpenCLMedFilt2d(self):
         """test cpp engine for medfilt2d"""
         res = medianfilter.medfilt2d(
-            image=TestMedianFilterEngines.IMG,
-            kernel_size=TestMedianFilterEngines.KERNEL,
-            engine='opencl')
-        self.assertTrue(numpy.array_equal(res, TestMedianFilterEngines.IMG))
+            image=self.IMG,
+            kernel_size=self.KERNEL,
+            engine='opencl',
+            ctx=self.ctx)
+        self.assertTrue(numpy.array_equal(res, self.IMG))
+
+    @unittest.skipUnless(numba, "numba is missing")
+    def testNumbaMedFilt2d(self):
+        """test numba engine for medfilt2d"""
+        res = medianfilter.medfilt2d(
+            image=self.IMG,
+            kernel_size=self.KERNEL,
+            engine='numba')
+        self.assertTrue(numpy.array_equal(res, self.IMG))
+
+    @unittest.skipUnless(numba, "numba is missing")
+    def testNumbaMedFilt2dVsCpp(self):
+        """test numba engine against cpp engine with a 5x3 kernel"""
+        image = numpy.random.random((50, 60)).astype(numpy.float32)
+        ref = medianfilter.medfilt2d(image=image, kernel_size=(5, 3), engine='cpp')
+        res = medianfilter.medfilt2d(image=image, kernel_size=(5, 3), engine='numba')
+        self.assertTrue(numpy.array_equal(res, ref))
+
+    @unittest.skipUnless(numba, "numba is missing")
+    def testNumbaMedFilt2dEvenKernel(self):
+        """test numba engine against cpp engine with a 4x2 kernel"""
+        image = numpy.random.random((50, 60)).astype(numpy.float32)
+        ref = medianfilter.medfilt2d(image=image, kernel_size=(4, 2), engine='cpp')
+        res = medianfilter.medfilt2d(image=image, kernel_size=(4, 2), engine='numba')
+        self.assertTrue(numpy.array_equal(res, ref))
+
+    @unittest.skipUnless(numba, "numba is missing")
+    def testNumbaMedFilt2dInteger(self):
+        """test numba engine keeps integer values"""
+        image = numpy.full((10, 10), 2 ** 24 + 1, dtype=numpy.int32)
+        res = medianfilter.medfilt2d(image=image, kernel_size=3, engine='numba')
+        self.assertEqual(res.dtype, numpy.int32)
+        self.assertTrue(numpy.array_equal(res, image))
 
 
 def suite():
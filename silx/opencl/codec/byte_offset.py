@@ -37,7 +37,7 @@ __authors__ = ["Jérôme Kieffer"]
 __contact__ = "jerome.kieffer@esrf.eu"
 __license__ = "MIT"
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
-__date__ = "11/10/2018"
+__date__ = "15/10/2026"
 __status__ = "production"
 
 
@@ -61,6 +61,37 @@ else:
     logger.warning("No PyOpenCL, no byte-offset, please see fabio")
 
 
+def _get_opencl_c_version(device):
+    """Returns the OpenCL C version supported by the device
+
+    :param pyopencl.Device device:
+    :return: (major, minor) version, (1, 0) if not parsable
+    :rtype: tuple
+    """
+    try:
+        version = device.opencl_c_version.split()[2]
+        return tuple(int(i) for i in version.split(".")[:2])
+    except (IndexError, ValueError, pyopencl.LogicError):
+        return (1, 0)
+
+
+def _has_non_uniform_workgroups(device):
+    """Returns True if the global size may not be a multiple of the workgroup size
+
+    This is mandatory in OpenCL 2.x and optional in OpenCL 3.0.
+
+    :param pyopencl.Device device:
+    :rtype: bool
+    """
+    version = _get_opencl_c_version(device)
+    if version < (2, 0):
+        return False
+    try:
+        return bool(device.non_uniform_work_group_support)
+    except (AttributeError, pyopencl.LogicError):
+        return version < (3, 0)
+
+
 class ByteOffset(OpenclProcessing):
     """Perform the byte offset compression/decompression on the GPU
 
@@ -74,6 +105,12 @@ class ByteOffset(OpenclProcessing):
             (mandatory for decompression)
         """
 
+    EXCEPTION_GROUPS_PER_CU = 16
+    """Number of persistent workgroups per compute unit treating exceptions"""
+
+    EXCEPTION_LANES = 1
+    """Number of work-items treating each exception region"""
+
     def __init__(self, raw_size=None, dec_size=None,
                  ctx=None, devicetype="all",
                  platformid=None, deviceid=None,
@@ -83,10 +120,20 @@ class ByteOffset(OpenclProcessing):
                                   block_size=block_size, profile=profile)
         if self.block_size is None:
             self.block_size = self.device.max_work_group_size
+        # Work sizes are passed as plain int: numpy scalars are slower to convert at each launch
+        self.block_size = int(self.block_size)
         wg = self.block_size
+        # Exception regions are short: a small workgroup, fixed at compile time, is enough
+        self.exception_wg = min(wg, 128)
+        # Lanes only share the writes of a region, not the walk along its tokens
+        if self.exception_wg % self.EXCEPTION_LANES == 0:
+            self.exception_lanes = self.EXCEPTION_LANES
+        else:
+            self.exception_lanes = 1
 
         buffers = [BufferDescription("counter", 1, numpy.int32, None)]
 
+        self.raw_used = 0
         if raw_size is None:
             self.raw_size = -1
             self.padded_raw_size = -1
@@ -100,153 +147,352 @@ class ByteOffset(OpenclProcessing):
                 BufferDescription("exceptions", self.padded_raw_size, numpy.int32, None)
             ]
 
+        # Output buffers are allocated on first use, see _get_output_buffer
         if dec_size is None:
             self.dec_size = None
         else:
             self.dec_size = numpy.int32(dec_size)
-            buffers += [
-                BufferDescription("data_float", self.dec_size, numpy.float32, None),
-                BufferDescription("data_int", self.dec_size, numpy.int32, None)
-            ]
 
         self.allocate_buffers(buffers, use_array=True)
-
-        self.compile_kernels([os.path.join("codec", "byte_offset")])
+        self._pinned_raw = None
+        self._pinned_raw_host = None
+        self._pinned_raw_event = None
+        if raw_size is not None:
+            self._allocate_pinned_raw(self.padded_raw_size)
+
+        compile_options = ["-DWG=%d" % self.exception_wg,
+                           "-DLANES=%d" % self.exception_lanes]
+        opencl_c_version = _get_opencl_c_version(self.ctx.devices[0])
+        self.exact_nd_range = _has_non_uniform_workgroups(self.ctx.devices[0])
+        if self.exact_nd_range:
+            compile_options += ["-cl-std=CL%d.%d" % opencl_c_version,
+                                "-DEXACT_ND_RANGE"]
+        self.compile_kernels([os.path.join("codec", "byte_offset")],
+                             compile_options=" ".join(compile_options))
         self.kernels.__setattr__("scan", self._init_double_scan())
         self.kernels.__setattr__("compression_scan",
                                  self._init_compression_scan())
 
     def _init_double_scan(self):
-        """"generates a double scan on indexes and values in one operation"""
+        """Generates the two scans on values and indexes, each on int32
+
+        :return: scan kernels for values (inclusive cumsum of unmasked values)
+                 and for indexes (position in the output array)
+        """
         arguments = "__global int *value", "__global int *index"
-        int2 = pyopencl.tools.get_or_register_dtype("int2")
-        input_expr = "index[i]>0 ? (int2)(0, 0) : (int2)(value[i], 1)"
-        scan_expr = "a+b"
-        neutral = "(int2)(0,0)"
-        output_statement = "value[i] = item.s0; index[i+1] = item.s1;"
+        scans = (("index[i]>0 ? 0 : value[i]", "value[i] = item;"),
+                 ("index[i]>0 ? 0 : 1", "if (i + 1 < N) index[i+1] = item;"))
 
         if self.block_size > 256:
-            knl = GenericScanKernel(self.ctx,
-                                    dtype=int2,
-                                    arguments=arguments,
-                                    input_expr=input_expr,
-                                    scan_expr=scan_expr,
-                                    neutral=neutral,
-                                    output_statement=output_statement)
+            scan_class = GenericScanKernel
         else:  # MacOS on CPU
-            knl = GenericDebugScanKernel(self.ctx,
-                                         dtype=int2,
-                                         arguments=arguments,
-                                         input_expr=input_expr,
-                                         scan_expr=scan_expr,
-                                         neutral=neutral,
-                                         output_statement=output_statement)
-        return knl
+            scan_class = GenericDebugScanKernel
+        return tuple(scan_class(self.ctx,
+                                dtype=numpy.int32,
+                                arguments=arguments,
+                                input_expr=input_expr,
+                                scan_expr="a+b",
+                                neutral="0",
+                                output_statement=output_statement)
+                     for input_expr, output_statement in scans)
+
+    def _allocate_pinned_raw(self, size):
+        """Allocate the page-locked host buffer used to upload the raw stream.
+
+        The buffer is mapped once and its numpy view is kept, so that the
+        upload of the raw stream is a direct DMA transfer.
+
+        :param int size: Size of the buffer in bytes
+        """
+        if self._pinned_raw_host is not None:
+            self._pinned_raw_host.base.release(self.queue)
+        mf = pyopencl.mem_flags
+        self._pinned_raw = pyopencl.Buffer(self.ctx,
+                                           mf.ALLOC_HOST_PTR | mf.READ_ONLY,
+                                           int(size))
+        self._pinned_raw_host, _ = pyopencl.enqueue_map_buffer(
+            self.queue, self._pinned_raw, pyopencl.map_flags.WRITE,
+            0, (int(size),), numpy.int8, is_blocking=True)
+        self._pinned_raw_event = None
+
+    def _get_output_buffer(self, name, dtype, shape=None):
+        """Returns the cached output buffer, allocate it if needed.
+
+        :param str name: Name of the buffer in cl_mem
+        :param dtype: Data type of the buffer
+        :param tuple shape: Shape of the buffer, (dec_size,) by default
+        :return: pyopencl array of the given shape
+        """
+        if shape is None:
+            shape = (int(self.dec_size),)
+        if (name not in self.cl_mem or
+                self.cl_mem[name] is None or
+                self.cl_mem[name].shape != shape):
+            logger.info("allocate %s output buffer of shape %s", name, shape)
+            self.cl_mem[name] = pyopencl.array.empty(self.queue,
+                                                     shape,
+                                                     dtype=dtype)
+        return self.cl_mem[name]
+
+    @staticmethod
+    def _as_int8(raw):
+        """Returns a view of the raw stream as a numpy array of int8
+
+        No reference on the view is kept: a bytearray can be resized once
+        decoded.
+
+        :param raw: The compressed data as a numpy array (of any shape)
+            or as bytes.
+        :rtype: numpy.ndarray
+        """
+        if isinstance(raw, numpy.ndarray):
+            return numpy.ascontiguousarray(raw).view(numpy.int8).ravel()
+        else:
+            return numpy.frombuffer(raw, dtype=numpy.int8)
 
-    def decode(self, raw, as_float=False, out=None):
+    def _upload_raw(self, raws, events):
+        """Concatenate and copy raw streams to the device, growing buffers if needed
+
+        :param list raws: compressed streams as numpy arrays of int8
+        :param list events: list of EventDescription to complete
+        :return: the total length of the streams (as numpy.int32, a kernel
+            argument) and the global size to use for element-wise kernels
+            (as int)
+        """
+        len_raw = numpy.int32(sum(raw.size for raw in raws))
+        wg = self.block_size
+        if len_raw > self.padded_raw_size:
+            # Grow geometrically to avoid a re-allocation for every frame
+            self.raw_size = max(int(len_raw), 2 * self.raw_size)
+            self.padded_raw_size = (self.raw_size + wg - 1) & ~(wg - 1)
+            logger.info("increase raw buffer size to %s", self.padded_raw_size)
+            buffers = {
+                       "raw": pyopencl.array.empty(self.queue, self.padded_raw_size, dtype=numpy.int8),
+                       "mask": pyopencl.array.empty(self.queue, self.padded_raw_size, dtype=numpy.int32),
+                       "exceptions": pyopencl.array.empty(self.queue, self.padded_raw_size, dtype=numpy.int32),
+                       "values": pyopencl.array.empty(self.queue, self.padded_raw_size, dtype=numpy.int32),
+                      }
+            self.cl_mem.update(buffers)
+            self._allocate_pinned_raw(self.padded_raw_size)
+        self.raw_used = int(len_raw)
+        if self.exact_nd_range:
+            padded_used = self.raw_used
+        else:
+            padded_used = (self.raw_used + wg - 1) & ~(wg - 1)
+
+        if self._pinned_raw_event is not None:
+            # The previous upload must be over before overwriting the pinned buffer
+            self._pinned_raw_event.wait()
+        start = 0
+        for raw in raws:
+            self._pinned_raw_host[start:start + raw.size] = raw
+            start += raw.size
+        evt = pyopencl.enqueue_copy(self.queue, self.cl_mem["raw"].data,
+                                    self._pinned_raw_host[:self.raw_used],
+                                    is_blocking=False)
+        self._pinned_raw_event = evt
+        events.append(EventDescription("copy raw H -> D", evt))
+        return len_raw, padded_used
+
+    def _decompress(self, len_raw, padded_used, events):
+        """Decompress the raw stream already on the device, up to the scans
+
+        Afterwards, the values buffer contains the cumulative sum of the
+        values and the mask buffer the index of each value in the output.
+
+        :param numpy.int32 len_raw: length of the raw stream
+        :param int padded_used: global size for element-wise kernels
+        :param list events: list of EventDescription to complete
+        :return: the last event
+        """
+        wg = self.block_size
+        evt = self.kernels.fill_int_mem(self.queue, (1,), (1,),
+                                        self.cl_mem["counter"].data,
+                                        numpy.int32(1),
+                                        numpy.int32(0),
+                                        numpy.int32(0))
+        events.append(EventDescription("memset counter", evt))
+        evt = self.kernels.fill_int_mem(self.queue, (padded_used,), (wg,),
+                                        self.cl_mem["mask"].data,
+                                        len_raw,
+                                        numpy.int32(0),
+                                        numpy.int32(0))
+        events.append(EventDescription("memset mask", evt))
+        evt = self.kernels.mark_exceptions(self.queue, (padded_used,), (wg,),
+                                           self.cl_mem["raw"].data,
+                                           len_raw,
+                                           self.cl_mem["mask"].data,
+                                           self.cl_mem["values"].data,
+                                           self.cl_mem["counter"].data,
+                                           self.cl_mem["exceptions"].data)
+        events.append(EventDescription("mark exceptions", evt))
+        # The number of exceptions stays on the device: no readback
+        evt = self.kernels.treat_exceptions(self.queue,
+                                            (self.exception_wg * self.EXCEPTION_GROUPS_PER_CU * self.device.cores,),
+                                            (self.exception_wg,),
+                                            self.cl_mem["raw"].data,
+                                            len_raw,
+                                            self.cl_mem["mask"].data,
+                                            self.cl_mem["exceptions"].data,
+                                            self.cl_mem["values"].data,
+                                            self.cl_mem["counter"].data
+                                            )
+        events.append(EventDescription("treat_exceptions", evt))
+
+        # The value scan reads the mask before the index scan overwrites it
+        value_scan, index_scan = self.kernels.scan
+        evt = value_scan(self.cl_mem["values"],
+                         self.cl_mem["mask"],
+                         queue=self.queue,
+                         size=int(len_raw),
+                         wait_for=(evt,))
+        events.append(EventDescription("value scan", evt))
+        evt = index_scan(self.cl_mem["values"],
+                         self.cl_mem["mask"],
+                         queue=self.queue,
+                         size=int(len_raw),
+                         wait_for=(evt,))
+        events.append(EventDescription("index scan", evt))
+        return evt
+
+    @staticmethod
+    def _check_dtype(dtype, as_float, out=None):
+        """Returns the output type of the decompression, int32 or float32
+
+        :param dtype: requested type or None to use as_float
+        :param bool as_float: True for float32, False for int32
+        :param out: output array or None, its type overrides as_float
+        :rtype: bool
+        :raises ValueError: if dtype or the type of out is neither int32 nor
+            float32, or if they differ
+        """
+        if out is not None:
+            if (dtype is not None) and (numpy.dtype(dtype) != out.dtype):
+                raise ValueError("Requested type %s differs from the type of "
+                                 "out, %s" % (numpy.dtype(dtype), out.dtype))
+            dtype = out.dtype
+        if dtype is None:
+            return as_float
+        dtype = numpy.dtype(dtype)
+        if dtype == numpy.float32:
+            return True
+        elif dtype == numpy.int32:
+            return False
+        raise ValueError("Decompression is only available as int32 or float32, "
+                         "got %s" % dtype)
+
+    def decode(self, raw, as_float=False, out=None, dtype=None):
         """This function actually performs the decompression by calling the kernels
 
-        :param numpy.ndarray raw: The compressed data as a 1D numpy array of char.
+        CBF byte offset data are int32, which is what is returned by default:
+        no cast to a larger type is needed afterwards. To retrieve the result
+        without allocating, use ``result.get(ary=host_array)`` with a
+        preallocated numpy array of the same type.
+
+        :param raw: The compressed data as a 1D numpy array of char or as bytes.
+        :type raw: Union[numpy.ndarray, bytes]
         :param bool as_float: True to decompress as float32,
                               False (default) to decompress as int32
         :param pyopencl.array out: pyopencl array in which to place the result.
+        :param dtype: numpy.int32 or numpy.float32, overrides as_float if given
         :return: The decompressed image as an pyopencl array.
+            The decompression is asynchronous: the array holds the event of
+            the last kernel in its ``events`` attribute.
         :rtype: pyopencl.array
+        :raises ValueError: if dtype or the type of out is neither int32 nor
+            float32, or if they differ
         """
         assert self.dec_size is not None, \
             "dec_size is a mandatory ByteOffset init argument for decompression"
+        as_float = self._check_dtype(dtype, as_float, out)
 
         events = []
         with self.sem:
-            len_raw = numpy.int32(len(raw))
-            if len_raw > self.padded_raw_size:
-                wg = self.block_size
-                self.raw_size = int(len(raw))
-                self.padded_raw_size = (self.raw_size + wg - 1) & ~(wg - 1)
-                logger.info("increase raw buffer size to %s", self.padded_raw_size)
-                buffers = {
-                           "raw": pyopencl.array.empty(self.queue, self.padded_raw_size, dtype=numpy.int8),
-                           "mask": pyopencl.array.empty(self.queue, self.padded_raw_size, dtype=numpy.int32),
-                           "exceptions": pyopencl.array.empty(self.queue, self.padded_raw_size, dtype=numpy.int32),
-                           "values": pyopencl.array.empty(self.queue, self.padded_raw_size, dtype=numpy.int32),
-                          }
-                self.cl_mem.update(buffers)
+            raw = self._as_int8(raw)
+            len_raw, padded_used = self._upload_raw([raw], events)
+            self._decompress(len_raw, padded_used, events)
+            if as_float:
+                copy_results = self.kernels.copy_result_float
+                if out is None:
+                    out = self._get_output_buffer("data_float", numpy.float32)
             else:
-                wg = self.block_size
+                copy_results = self.kernels.copy_result_int
+                if out is None:
+                    out = self._get_output_buffer("data_int", numpy.int32)
+            evt = copy_results(self.queue, (padded_used,), (self.block_size,),
+                               self.cl_mem["values"].data,
+                               self.cl_mem["mask"].data,
+                               len_raw,
+                               self.dec_size,
+                               out.data
+                               )
+            events.append(EventDescription("copy_results", evt))
+            out.add_event(evt)
+            if self.profile:
+                self.events += events
+        return out
 
-            evt = pyopencl.enqueue_copy(self.queue, self.cl_mem["raw"].data,
-                                        raw,
-                                        is_blocking=False)
-            events.append(EventDescription("copy raw H -> D", evt))
-            evt = self.kernels.fill_int_mem(self.queue, (self.padded_raw_size,), (wg,),
-                                            self.cl_mem["mask"].data,
-                                            numpy.int32(self.padded_raw_size),
-                                            numpy.int32(0),
-                                            numpy.int32(0))
-            events.append(EventDescription("memset mask", evt))
-            evt = self.kernels.fill_int_mem(self.queue, (1,), (1,),
-                                            self.cl_mem["counter"].data,
-                                            numpy.int32(1),
-                                            numpy.int32(0),
-                                            numpy.int32(0))
-            events.append(EventDescription("memset counter", evt))
-            evt = self.kernels.mark_exceptions(self.queue, (self.padded_raw_size,), (wg,),
-                                               self.cl_mem["raw"].data,
-                                               len_raw,
-                                               numpy.int32(self.raw_size),
-                                               self.cl_mem["mask"].data,
-                                               self.cl_mem["values"].data,
-                                               self.cl_mem["counter"].data,
-                                               self.cl_mem["exceptions"].data)
-            events.append(EventDescription("mark exceptions", evt))
-            nb_exceptions = numpy.empty(1, dtype=numpy.int32)
-            evt = pyopencl.enqueue_copy(self.queue, nb_exceptions, self.cl_mem["counter"].data,
-                                        is_blocking=False)
-            events.append(EventDescription("copy counter D -> H", evt))
-            evt.wait()
-            nbexc = int(nb_exceptions[0])
-            if nbexc == 0:
-                logger.info("nbexc %i", nbexc)
-            else:
-                evt = self.kernels.treat_exceptions(self.queue, (nbexc,), (1,),
-                                                    self.cl_mem["raw"].data,
-                                                    len_raw,
-                                                    self.cl_mem["mask"].data,
-                                                    self.cl_mem["exceptions"].data,
-                                                    self.cl_mem["values"].data
-                                                    )
-                events.append(EventDescription("treat_exceptions", evt))
-
-            #self.cl_mem["copy_values"] = self.cl_mem["values"].copy()
-            #self.cl_mem["copy_mask"] = self.cl_mem["mask"].copy()
-            evt = self.kernels.scan(self.cl_mem["values"],
-                                    self.cl_mem["mask"],
-                                    queue=self.queue,
-                                    size=int(len_raw),
-                                    wait_for=(evt,))
-            events.append(EventDescription("double scan", evt))
-            #evt.wait()
-            if out is not None:
-                if out.dtype == numpy.float32:
-                    copy_results = self.kernels.copy_result_float
-                else:
-                    copy_results = self.kernels.copy_result_int
+    def decode_batch(self, raws, as_float=False, out=None, dtype=None):
+        """Decompress several frames at once, each kernel being launched once
+
+        The streams are concatenated and decompressed as a single stream,
+        then each value is shifted by the last value of the previous frame.
+
+        :param raws: The compressed frames, each as a 1D numpy array of char
+            or as bytes.
+        :type raws: List[Union[numpy.ndarray, bytes]]
+        :param bool as_float: True to decompress as float32,
+                              False (default) to decompress as int32
+        :param pyopencl.array out: pyopencl array of shape
+            (len(raws), dec_size) in which to place the result.
+        :param dtype: numpy.int32 or numpy.float32, overrides as_float if given
+        :return: The decompressed images as a 2D pyopencl array.
+            The decompression is asynchronous, as for :meth:`decode`.
+        :rtype: pyopencl.array
+        :raises ValueError: if dtype or the type of out is neither int32 nor
+            float32, or if they differ
+        """
+        assert self.dec_size is not None, \
+            "dec_size is a mandatory ByteOffset init argument for decompression"
+        as_float = self._check_dtype(dtype, as_float, out)
+
+        events = []
+        with self.sem:
+            raws = [self._as_int8(raw) for raw in raws]
+            nb_frames = len(raws)
+            offsets = numpy.cumsum([0] + [raw.size for raw in raws],
+                                   dtype=numpy.int32)
+            if ("offsets" not in self.cl_mem or
+                    self.cl_mem["offsets"] is None or
+                    self.cl_mem["offsets"].size < offsets.size):
+                self.cl_mem["offsets"] = pyopencl.array.empty(self.queue,
+                                                              offsets.size,
+                                                              dtype=numpy.int32)
+            evt = pyopencl.enqueue_copy(self.queue, self.cl_mem["offsets"].data,
+                                        offsets, is_blocking=False)
+            events.append(EventDescription("copy offsets H -> D", evt))
+            len_raw, padded_used = self._upload_raw(raws, events)
+            self._decompress(len_raw, padded_used, events)
+            shape = (nb_frames, int(self.dec_size))
+            if as_float:
+                copy_results = self.kernels.copy_result_batch_float
+                if out is None:
+                    out = self._get_output_buffer("batch_float", numpy.float32, shape)
             else:
-                if as_float:
-                    out = self.cl_mem["data_float"]
-                    copy_results = self.kernels.copy_result_float
-                else:
-                    out = self.cl_mem["data_int"]
-                    copy_results = self.kernels.copy_result_int
-            evt = copy_results(self.queue, (self.padded_raw_size,), (wg,),
+                copy_results = self.kernels.copy_result_batch_int
+                if out is None:
+                    out = self._get_output_buffer("batch_int", numpy.int32, shape)
+            evt = copy_results(self.queue, (padded_used,), (self.block_size,),
                                self.cl_mem["values"].data,
                                self.cl_mem["mask"].data,
                                len_raw,
                                self.dec_size,
+                               self.cl_mem["offsets"].data,
+                               numpy.int32(nb_frames),
                                out.data
                                )
-            events.append(EventDescription("copy_results", evt))
-            #evt.wait()
+            events.append(EventDescription("copy_results batch", evt))
+            out.add_event(evt)
             if self.profile:
                 self.events += events
         return out
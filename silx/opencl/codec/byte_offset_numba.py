@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/silx-kit/silx
+#
+#    Copyright (C) 2013-2026  European Synchrotron Radiation Facility, Grenoble, France
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+This module provides CBF byte offset decompression on the CPU with numba.
+
+Unlike :class:`silx.opencl.codec.byte_offset.ByteOffset`, which marks the
+exceptions, treats them, then scans the values, the stream is decoded in a
+single sequential pass, which is faster on a CPU. It does not require OpenCL.
+"""
+
+from __future__ import division, print_function, with_statement
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "15/10/2026"
+__status__ = "production"
+
+
+import numpy
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import numba
+except ImportError:
+    numba = None
+    logger.warning("No numba, no CPU byte-offset, please see fabio")
+
+
+if numba is not None:
+    # The raw stream is often a read-only view on bytes
+    _raw_t = numba.types.Array(numba.int8, 1, "A", readonly=True)
+
+    @numba.njit([numba.intp(_raw_t, numba.int32[:]),
+                 numba.intp(_raw_t, numba.float32[:])],
+                cache=True)
+    def _decode(raw, out):
+        """Decode the stream in a single pass
+
+        Simple data (one byte) are the fast path, exceptions are decoded inline.
+
+        :param raw: compressed stream
+        :param out: output array
+        :return: the number of values written
+        """
+        size = raw.size
+        accumulator = numpy.int32(0)
+        pos = 0
+        count = 0
+        while (pos < size) and (count < out.size):
+            value = numpy.int32(raw[pos])
+            pos += 1
+            if value == -128 and pos + 1 < size:
+                # 16 bits exception
+                value = (numpy.int32(numpy.uint8(raw[pos])) |
+                         (numpy.int32(raw[pos + 1]) << 8))
+                pos += 2
+                if value == -32768 and pos + 3 < size:
+                    # 32 bits exception
+                    value = (numpy.int32(numpy.uint8(raw[pos])) |
+                             (numpy.int32(numpy.uint8(raw[pos + 1])) << 8) |
+                             (numpy.int32(numpy.uint8(raw[pos + 2])) << 16) |
+                             (numpy.int32(raw[pos + 3]) << 24))
+                    pos += 4
+            # Integer overflow wraps as in the compressor
+            accumulator = numpy.int32(accumulator + value)
+            out[count] = accumulator
+            count += 1
+        return count
+else:  # numba not installed
+    _decode = None
+
+
+def decode(raw, dec_size, as_float=False, out=None):
+    """Decompress a CBF byte offset stream on the CPU
+
+    :param raw: The compressed data as a 1D numpy array of char or as bytes.
+    :type raw: Union[numpy.ndarray, bytes]
+    :param int dec_size: Size of the decompressed array
+    :param bool as_float: True to decompress as float32,
+                          False (default) to decompress as int32
+    :param numpy.ndarray out: int32 or float32 array in which to place
+                              the result.
+    :return: The decompressed image as a 1D numpy array
+    :rtype: numpy.ndarray
+    :raises RuntimeError: if numba is not available
+    """
+    if numba is None:
+        raise RuntimeError("numba is required for byte-offset decompression on CPU")
+    if isinstance(raw, numpy.ndarray):
+        raw = numpy.ascontiguousarray(raw).view(numpy.int8).ravel()
+    else:
+        raw = numpy.frombuffer(raw, dtype=numpy.int8)
+    if out is None:
+        out = numpy.zeros(dec_size, dtype=numpy.float32 if as_float else numpy.int32)
+
+    _decode(raw, out)
+    return out
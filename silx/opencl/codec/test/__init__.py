@@ -24,14 +24,16 @@
 
 __authors__ = ["J. Kieffer"]
 __license__ = "MIT"
-__date__ = "13/10/2017"
+__date__ = "15/10/2026"
 
 import unittest
 from . import test_byte_offset
+from . import test_byte_offset_numba
 
 
 def suite():
     testSuite = unittest.TestSuite()
     testSuite.addTest(test_byte_offset.suite())
+    testSuite.addTest(test_byte_offset_numba.suite())
 
     return testSuite
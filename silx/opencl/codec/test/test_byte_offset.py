@@ -37,7 +37,7 @@ __authors__ = ["Jérôme Kieffer"]
 __contact__ = "jerome.kieffer@esrf.eu"
 __license__ = "MIT"
 __copyright__ = "2013 European Synchrotron Radiation Facility, Grenoble, France"
-__date__ = "10/11/2017"
+__date__ = "15/10/2026"
 
 import sys
 import time
@@ -45,40 +45,27 @@ import logging
 import numpy
 from silx.opencl.common import ocl, pyopencl
 from silx.opencl.codec import byte_offset
+from .utils import create_test_data
 import fabio
 import unittest
 logger = logging.getLogger(__name__)
 
 
+class ByteOffsetLanes(byte_offset.ByteOffset):
+    """ByteOffset treating each exception region with 8 work-items"""
+    EXCEPTION_LANES = 8
+
+
 @unittest.skipUnless(ocl and pyopencl,
                      "PyOpenCl is missing")
 class TestByteOffset(unittest.TestCase):
 
-    @staticmethod
-    def _create_test_data(shape, nexcept, lam=200):
-        """Create test (image, compressed stream) pair.
-
-        :param shape: Shape of test image
-        :param int nexcept: Number of exceptions in the image
-        :param lam: Expectation of interval argument for numpy.random.poisson
-        :return: (reference image array, compressed stream)
-        """
-        size = numpy.prod(shape)
-        ref = numpy.random.poisson(lam, numpy.prod(shape))
-        exception_loc = numpy.random.randint(0, size, size=nexcept)
-        exception_value = numpy.random.randint(0, 1000000, size=nexcept)
-        ref[exception_loc] = exception_value
-        ref.shape = shape
-
-        raw = fabio.compression.compByteOffset(ref)
-        return ref, raw
-
     def test_decompress(self):
         """
         tests the byte offset decompression on GPU
         """
-        ref, raw = self._create_test_data(shape=(91, 97), nexcept=229)
-        #ref, raw = self._create_test_data(shape=(7, 9), nexcept=0)
+        ref, raw = create_test_data(shape=(91, 97), nexcept=229)
+        #ref, raw = create_test_data(shape=(7, 9), nexcept=0)
         
         size = numpy.prod(ref.shape)
 
@@ -109,6 +96,175 @@ class TestByteOffset(unittest.TestCase):
         self.assertEqual(delta_cy, 0, "Checks fabio works")
         self.assertEqual(delta_cl, 0, "Checks opencl works")
 
+    def test_decompress_dtype(self):
+        """
+        tests the choice of the output type of the byte offset decompression
+        """
+        ref, raw = create_test_data(shape=(91, 97), nexcept=229)
+        size = numpy.prod(ref.shape)
+
+        try:
+            bo = byte_offset.ByteOffset(raw_size=len(raw), dec_size=size, profile=True)
+        except (RuntimeError, pyopencl.RuntimeError) as err:
+            logger.warning(err)
+            if sys.platform == "darwin":
+                raise unittest.SkipTest("Byte-offset decompression is known to be buggy on MacOS-CPU")
+            else:
+                raise err
+
+        for dtype in (numpy.int32, numpy.float32):
+            res_cl = bo.decode(raw, dtype=dtype)
+            self.assertEqual(res_cl.dtype, dtype)
+            host = numpy.empty(size, dtype=dtype)
+            res_cl.get(ary=host)
+            self.assertEqual(abs(ref.ravel() - host).max(), 0,
+                             "Checks opencl works as %s" % numpy.dtype(dtype))
+        with self.assertRaises(ValueError):
+            bo.decode(raw, dtype=numpy.int64)
+
+    def test_decompress_out(self):
+        """
+        tests the type checks of the output array of the byte offset
+        decompression
+        """
+        ref, raw = create_test_data(shape=(91, 97), nexcept=229)
+        size = numpy.prod(ref.shape)
+
+        try:
+            bo = byte_offset.ByteOffset(raw_size=len(raw), dec_size=size, profile=True)
+        except (RuntimeError, pyopencl.RuntimeError) as err:
+            logger.warning(err)
+            if sys.platform == "darwin":
+                raise unittest.SkipTest("Byte-offset decompression is known to be buggy on MacOS-CPU")
+            else:
+                raise err
+
+        for dtype in (numpy.int32, numpy.float32):
+            out = pyopencl.array.empty(bo.queue, size, dtype=dtype)
+            res_cl = bo.decode(raw, out=out, dtype=dtype)
+            self.assertIs(res_cl, out)
+            self.assertEqual(abs(ref.ravel() - res_cl.get()).max(), 0,
+                             "Checks opencl works in %s" % numpy.dtype(dtype))
+
+        out = pyopencl.array.empty(bo.queue, size, dtype=numpy.float32)
+        with self.assertRaises(ValueError):
+            bo.decode(raw, out=out, dtype=numpy.int32)
+        with self.assertRaises(ValueError):
+            bo.decode_batch([raw], out=out.reshape(1, size), dtype=numpy.int32)
+        out = pyopencl.array.empty(bo.queue, size, dtype=numpy.float64)
+        with self.assertRaises(ValueError):
+            bo.decode(raw, out=out)
+        with self.assertRaises(ValueError):
+            bo.decode_batch([raw], out=out.reshape(1, size))
+
+    @staticmethod
+    def _create_long_exceptions():
+        """Create data with runs of consecutive exceptions much longer than
+        a workgroup
+
+        :return: reference array and its compressed stream
+        """
+        ref = numpy.random.poisson(200, 10000).astype(numpy.int32)
+        # 16 bits and 32 bits exceptions, 3 and 7 bytes each
+        ref[1000:2000] = numpy.random.randint(-30000, 30000, size=1000)
+        ref[3001:3500:2] = 1000000
+        ref[5000:6000] = numpy.random.randint(-2 ** 30, 2 ** 30, size=1000)
+        ref[-300:] = numpy.random.randint(-2 ** 30, 2 ** 30, size=300)
+        return ref, fabio.compression.compByteOffset(ref)
+
+    def test_decompress_long_exceptions(self):
+        """
+        tests the byte offset decompression with runs of consecutive
+        exceptions much longer than a workgroup
+        """
+        ref, raw = self._create_long_exceptions()
+
+        try:
+            bo = byte_offset.ByteOffset(raw_size=len(raw), dec_size=ref.size, profile=True)
+        except (RuntimeError, pyopencl.RuntimeError) as err:
+            logger.warning(err)
+            if sys.platform == "darwin":
+                raise unittest.SkipTest("Byte-offset decompression is known to be buggy on MacOS-CPU")
+            else:
+                raise err
+
+        res_cl = bo.decode(raw)
+        self.assertEqual(abs(ref - res_cl.get()).max(), 0, "Checks opencl works")
+
+    def test_decompress_lanes(self):
+        """
+        tests the byte offset decompression with several work-items
+        per exception region
+        """
+        ref, raw = self._create_long_exceptions()
+
+        try:
+            bo = ByteOffsetLanes(raw_size=len(raw), dec_size=ref.size, profile=True)
+        except (RuntimeError, pyopencl.RuntimeError) as err:
+            logger.warning(err)
+            if sys.platform == "darwin":
+                raise unittest.SkipTest("Byte-offset decompression is known to be buggy on MacOS-CPU")
+            else:
+                raise err
+        if bo.exception_lanes == 1:
+            raise unittest.SkipTest("Workgroup too small for %s lanes" % bo.EXCEPTION_LANES)
+
+        res_cl = bo.decode(raw)
+        self.assertEqual(abs(ref - res_cl.get()).max(), 0, "Checks opencl works")
+
+        ref, raw = create_test_data(shape=(91, 97), nexcept=229)
+        res_cl = bo.decode(raw)
+        self.assertEqual(abs(ref.ravel() - res_cl.get()[:ref.size]).max(), 0,
+                         "Checks opencl works")
+
+    def test_decompress_bytearray(self):
+        """
+        tests that a bytearray can be resized once decompressed
+        """
+        ref, raw = create_test_data(shape=(91, 97), nexcept=229)
+        size = numpy.prod(ref.shape)
+
+        try:
+            bo = byte_offset.ByteOffset(raw_size=len(raw), dec_size=size, profile=True)
+        except (RuntimeError, pyopencl.RuntimeError) as err:
+            logger.warning(err)
+            if sys.platform == "darwin":
+                raise unittest.SkipTest("Byte-offset decompression is known to be buggy on MacOS-CPU")
+            else:
+                raise err
+
+        buffer = bytearray(raw)
+        res_cl = bo.decode(buffer)
+        self.assertEqual(abs(ref.ravel() - res_cl.get()).max(), 0, "Checks opencl works")
+        buffer.extend(raw)
+        self.assertEqual(len(buffer), 2 * len(raw))
+
+    def test_decompress_ndarray(self):
+        """
+        tests the byte offset decompression of a raw stream stored
+        in a multi-dimensional, non contiguous, numpy array
+        """
+        ref, raw = create_test_data(shape=(91, 97), nexcept=229)
+        size = numpy.prod(ref.shape)
+        if len(raw) % 2:
+            # Trailing byte decoded past the end of the output
+            raw += b"\x00"
+
+        try:
+            bo = byte_offset.ByteOffset(raw_size=len(raw), dec_size=size, profile=True)
+        except (RuntimeError, pyopencl.RuntimeError) as err:
+            logger.warning(err)
+            if sys.platform == "darwin":
+                raise unittest.SkipTest("Byte-offset decompression is known to be buggy on MacOS-CPU")
+            else:
+                raise err
+
+        raw_2d = numpy.frombuffer(raw, dtype=numpy.uint8).reshape(2, -1)
+        res_cl = bo.decode(raw_2d)
+        self.assertEqual(abs(ref.ravel() - res_cl.get()).max(), 0, "Checks opencl works")
+        res_cl = bo.decode(numpy.asfortranarray(raw_2d))
+        self.assertEqual(abs(ref.ravel() - res_cl.get()).max(), 0, "Checks opencl works")
+
     def test_many_decompress(self, ntest=10):
         """
         tests the byte offset decompression on GPU, many images to ensure there 
@@ -116,7 +272,7 @@ class TestByteOffset(unittest.TestCase):
         """
         shape = (991, 997)
         size = numpy.prod(shape)
-        ref, raw = self._create_test_data(shape=shape, nexcept=0, lam=100)
+        ref, raw = create_test_data(shape=shape, nexcept=0, lam=100)
 
         try:
             bo = byte_offset.ByteOffset(len(raw), size, profile=False)
@@ -140,7 +296,7 @@ class TestByteOffset(unittest.TestCase):
                      1000.0 * (t2 - t1))
 
         for i in range(ntest):
-            ref, raw = self._create_test_data(shape=shape, nexcept=2729, lam=200)
+            ref, raw = create_test_data(shape=shape, nexcept=2729, lam=200)
 
             t0 = time.time()
             res_cy = fabio.compression.decByteOffset(raw)
@@ -156,9 +312,76 @@ class TestByteOffset(unittest.TestCase):
                          1000.0 * (t1 - t0),
                          1000.0 * (t2 - t1))
 
+    def test_decompress_batch(self):
+        """
+        tests the byte offset decompression of several frames at once
+        """
+        shape = (91, 97)
+        size = numpy.prod(shape)
+        refs, raws = [], []
+        for i in range(5):
+            ref, raw = create_test_data(shape=shape, nexcept=229)
+            if i % 2:
+                # Frame ending with an exception
+                ref[-1, -1] = 1000000
+                raw = fabio.compression.compByteOffset(ref)
+            refs.append(ref.ravel())
+            raws.append(raw)
+
+        try:
+            bo = byte_offset.ByteOffset(dec_size=size, profile=True)
+        except (RuntimeError, pyopencl.RuntimeError) as err:
+            logger.warning(err)
+            if sys.platform == "darwin":
+                raise unittest.SkipTest("Byte-offset decompression is known to be buggy on MacOS-CPU")
+            else:
+                raise err
+
+        t0 = time.time()
+        res_cl = bo.decode_batch(raws)
+        t1 = time.time()
+        logger.debug("Batch execution time: OpenCL: %.3fms.", 1000.0 * (t1 - t0))
+        self.assertEqual(res_cl.shape, (len(raws), size))
+        self.assertEqual(abs(numpy.array(refs) - res_cl.get()).max(), 0,
+                         "Checks opencl batch works")
+
+        res_cl = bo.decode_batch(raws, as_float=True)
+        self.assertEqual(res_cl.dtype, numpy.float32)
+        self.assertEqual(abs(numpy.array(refs) - res_cl.get()).max(), 0,
+                         "Checks opencl batch works as float")
+        bo.log_profile()
+
+    def test_decompress_exact_nd_range(self):
+        """
+        tests the byte offset decompression launched on the exact size of the
+        stream, on devices supporting non-uniform workgroups
+        """
+        ref, raw = create_test_data(shape=(91, 97), nexcept=229)
+        size = numpy.prod(ref.shape)
+
+        try:
+            bo = byte_offset.ByteOffset(dec_size=size, profile=True)
+        except (RuntimeError, pyopencl.RuntimeError) as err:
+            logger.warning(err)
+            if sys.platform == "darwin":
+                raise unittest.SkipTest("Byte-offset decompression is known to be buggy on MacOS-CPU")
+            else:
+                raise err
+        if not bo.exact_nd_range:
+            raise unittest.SkipTest("Device without non-uniform workgroups")
+        if len(raw) % bo.block_size == 0:
+            # The stream must not fill the last workgroup: one more pixel
+            raw += b"\x01"
+            ref = fabio.compression.decByteOffset(raw)[:size]
+
+        res_cl = bo.decode(raw)
+        self.assertEqual(abs(ref.ravel() - res_cl.get()).max(), 0, "Checks opencl works")
+        res_cl = bo.decode_batch([raw, raw])
+        self.assertEqual(abs(ref.ravel() - res_cl.get()).max(), 0, "Checks opencl batch works")
+
     def test_encode(self):
         """Test byte offset compression"""
-        ref, raw = self._create_test_data(shape=(2713, 2719), nexcept=2729)
+        ref, raw = create_test_data(shape=(2713, 2719), nexcept=2729)
 
         try:
             bo = byte_offset.ByteOffset(len(raw), ref.size, profile=True)
@@ -180,7 +403,7 @@ class TestByteOffset(unittest.TestCase):
     def test_encode_to_array(self):
         """Test byte offset compression while providing an out array"""
 
-        ref, raw = self._create_test_data(shape=(2713, 2719), nexcept=2729)
+        ref, raw = create_test_data(shape=(2713, 2719), nexcept=2729)
 
         try:
             bo = byte_offset.ByteOffset(profile=True)
@@ -208,7 +431,7 @@ class TestByteOffset(unittest.TestCase):
 
     def test_encode_to_bytes(self):
         """Test byte offset compression to bytes"""
-        ref, raw = self._create_test_data(shape=(2713, 2719), nexcept=2729)
+        ref, raw = create_test_data(shape=(2713, 2719), nexcept=2729)
 
         try:
             bo = byte_offset.ByteOffset(profile=True)
@@ -232,7 +455,7 @@ class TestByteOffset(unittest.TestCase):
     def test_encode_to_bytes_from_array(self):
         """Test byte offset compression to bytes from a pyopencl array.
         """
-        ref, raw = self._create_test_data(shape=(2713, 2719), nexcept=2729)
+        ref, raw = create_test_data(shape=(2713, 2719), nexcept=2729)
 
         try:
             bo = byte_offset.ByteOffset(profile=True)
@@ -259,7 +482,7 @@ class TestByteOffset(unittest.TestCase):
     def test_many_encode(self, ntest=10):
         """Test byte offset compression with many image"""
         shape = (991, 997)
-        ref, raw = self._create_test_data(shape=shape, nexcept=0, lam=100)
+        ref, raw = create_test_data(shape=shape, nexcept=0, lam=100)
 
         try:
             bo = byte_offset.ByteOffset(profile=False)
@@ -282,7 +505,7 @@ class TestByteOffset(unittest.TestCase):
                      1000.0 * (t2 - t1))
 
         for i in range(ntest):
-            ref, raw = self._create_test_data(shape=shape, nexcept=2729, lam=200)
+            ref, raw = create_test_data(shape=shape, nexcept=2729, lam=200)
 
             t0 = time.time()
             res_fabio = fabio.compression.compByteOffset(ref)
@@ -302,13 +525,68 @@ class TestByteOffset(unittest.TestCase):
                      numpy.max(bo_durations))
 
 
+class _Device(object):
+    """Stand-in for a pyopencl.Device, with the given version strings"""
+
+    def __init__(self, opencl_c_version, non_uniform=None):
+        self._opencl_c_version = opencl_c_version
+        self._non_uniform = non_uniform
+
+    @property
+    def opencl_c_version(self):
+        if self._opencl_c_version is None:
+            raise pyopencl.LogicError("clGetDeviceInfo failed")
+        return self._opencl_c_version
+
+    @property
+    def non_uniform_work_group_support(self):
+        if self._non_uniform is None:
+            raise AttributeError("non_uniform_work_group_support")
+        return self._non_uniform
+
+
+@unittest.skipUnless(pyopencl, "PyOpenCl is missing")
+class TestDeviceVersion(unittest.TestCase):
+
+    def test_opencl_c_version(self):
+        """Parsing of the OpenCL C version of the device"""
+        self.assertEqual(byte_offset._get_opencl_c_version(_Device("OpenCL C 1.2 PoCL")), (1, 2))
+        self.assertEqual(byte_offset._get_opencl_c_version(_Device("OpenCL C 2.0 ")), (2, 0))
+        self.assertEqual(byte_offset._get_opencl_c_version(_Device("OpenCL C 3.0")), (3, 0))
+        self.assertEqual(byte_offset._get_opencl_c_version(_Device("OpenCL C")), (1, 0))
+        self.assertEqual(byte_offset._get_opencl_c_version(_Device("OpenCL C x.y")), (1, 0))
+        self.assertEqual(byte_offset._get_opencl_c_version(_Device(None)), (1, 0))
+
+    def test_non_uniform_workgroups(self):
+        """Detection of the support of non-uniform workgroups"""
+        self.assertFalse(byte_offset._has_non_uniform_workgroups(_Device("OpenCL C 1.2")))
+        self.assertFalse(byte_offset._has_non_uniform_workgroups(_Device("OpenCL C 1.2", True)))
+        self.assertFalse(byte_offset._has_non_uniform_workgroups(_Device(None)))
+        # Mandatory in OpenCL 2.x, optional in OpenCL 3.0
+        self.assertTrue(byte_offset._has_non_uniform_workgroups(_Device("OpenCL C 2.0")))
+        self.assertTrue(byte_offset._has_non_uniform_workgroups(_Device("OpenCL C 2.0", True)))
+        self.assertFalse(byte_offset._has_non_uniform_workgroups(_Device("OpenCL C 3.0")))
+        self.assertFalse(byte_offset._has_non_uniform_workgroups(_Device("OpenCL C 3.0", False)))
+        self.assertTrue(byte_offset._has_non_uniform_workgroups(_Device("OpenCL C 3.0", True)))
+
+
 def suite():
     test_suite = unittest.TestSuite()
     test_suite.addTest(TestByteOffset("test_decompress"))
+    test_suite.addTest(TestByteOffset("test_decompress_dtype"))
+    test_suite.addTest(TestByteOffset("test_decompress_out"))
+    test_suite.addTest(TestByteOffset("test_decompress_long_exceptions"))
+    test_suite.addTest(TestByteOffset("test_decompress_lanes"))
+    test_suite.addTest(TestByteOffset("test_decompress_bytearray"))
+    test_suite.addTest(TestByteOffset("test_decompress_ndarray"))
     test_suite.addTest(TestByteOffset("test_many_decompress"))
+    test_suite.addTest(TestByteOffset("test_decompress_batch"))
+    test_suite.addTest(TestByteOffset("test_decompress_exact_nd_range"))
     test_suite.addTest(TestByteOffset("test_encode"))
     test_suite.addTest(TestByteOffset("test_encode_to_array"))
     test_suite.addTest(TestByteOffset("test_encode_to_bytes"))
     test_suite.addTest(TestByteOffset("test_encode_to_bytes_from_array"))
     test_suite.addTest(TestByteOffset("test_many_encode"))
+    test_suite.addTest(TestDeviceVersion("test_opencl_c_version"))
+    test_suite.addTest(TestDeviceVersion("test_non_uniform_workgroups"))
     return test_suite
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Byte-offset decompression in OpenCL
+#             https://github.com/silx-kit/silx
+#
+#    Copyright (C) 2013-2020  European Synchrotron Radiation Facility,
+#                             Grenoble, France
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Test suite for byte-offset decompression on CPU with numba
+"""
+
+from __future__ import division, print_function
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "MIT"
+__copyright__ = "2013 European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "15/10/2026"
+
+import time
+import logging
+import numpy
+from silx.opencl.codec import byte_offset_numba
+from .utils import create_test_data
+import fabio
+import unittest
+logger = logging.getLogger(__name__)
+
+
+@unittest.skipUnless(byte_offset_numba.numba, "numba is missing")
+class TestByteOffsetNumba(unittest.TestCase):
+
+    def test_decompress(self):
+        """
+        tests the byte offset decompression on CPU with numba
+        """
+        ref, raw = create_test_data(shape=(991, 997), nexcept=2729)
+        size = numpy.prod(ref.shape)
+
+        t0 = time.time()
+        res_cy = fabio.compression.decByteOffset(raw)
+        t1 = time.time()
+        res_nb = byte_offset_numba.decode(raw, size)
+        t2 = time.time()
+        logger.debug("Global execution time: fabio %.3fms, numba: %.3fms.",
+                     1000.0 * (t1 - t0),
+                     1000.0 * (t2 - t1))
+        self.assertEqual(res_nb.dtype, numpy.int32)
+        self.assertEqual(abs(ref.ravel() - res_cy).max(), 0, "Checks fabio works")
+        self.assertEqual(abs(ref.ravel() - res_nb).max(), 0, "Checks numba works")
+
+    def test_decompress_float(self):
+        """
+        tests the byte offset decompression on CPU with numba as float32
+        """
+        ref, raw = create_test_data(shape=(91, 97), nexcept=229)
+        size = numpy.prod(ref.shape)
+        raw = numpy.frombuffer(raw, dtype=numpy.int8)
+        res_nb = byte_offset_numba.decode(raw, size, as_float=True)
+        self.assertEqual(res_nb.dtype, numpy.float32)
+        self.assertEqual(abs(ref.ravel() - res_nb).max(), 0, "Checks numba works")
+
+
+def suite():
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(TestByteOffsetNumba("test_decompress"))
+    test_suite.addTest(TestByteOffsetNumba("test_decompress_float"))
+    return test_suite
@@ -40,7 +40,7 @@ __author__ = "Jerome Kieffer"
 __contact__ = "Jerome.Kieffer@ESRF.eu"
 __license__ = "MIT"
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
-__date__ = "24/11/2020"
+__date__ = "15/10/2026"
 __status__ = "stable"
 
 import os
@@ -49,6 +49,7 @@ import gc
 from collections import namedtuple
 import numpy
 import threading
+import weakref
 from .common import ocl, pyopencl, release_cl_buffers, kernel_workgroup_size, allocate_texture, check_textures_availability
 from .utils import concatenate_cl_kernel
 import platform
@@ -59,6 +60,45 @@ EventDescription = namedtuple("EventDescription", ["name", "event"])
 logger = logging.getLogger(__name__)
 
 
+# Programs built for each context, keyed by (source, options).
+# The bare programs do not reference their context: they are released with it.
+_programs = weakref.WeakKeyDictionary()
+_programs_lock = threading.Lock()
+
+
+def _build_program(ctx, kernel_src, compile_options):
+    """Build an OpenCL program, cached for a given context, source and options
+
+    Kernels are not shared: :class:`KernelContainer` retrieves new kernel
+    instances from the program.
+
+    :param ctx: OpenCL context
+    :param str kernel_src: source code of the program
+    :param str compile_options: options passed to the compiler
+    :return: the built pyopencl.Program
+    """
+    with _programs_lock:
+        programs = _programs.setdefault(ctx, {})
+        key = (kernel_src, compile_options)
+        if key not in programs:
+            program = pyopencl.Program(ctx, kernel_src).build(options=compile_options)
+            programs[key] = program._prg
+        return pyopencl.Program(programs[key])
+
+
+def _release_program(ctx, kernel_src, compile_options):
+    """Remove a program from the cache of built programs
+
+    :param ctx: OpenCL context
+    :param str kernel_src: source code of the program
+    :param str compile_options: options passed to the compiler
+    """
+    with _programs_lock:
+        programs = _programs.get(ctx)
+        if programs is not None:
+            programs.pop((kernel_src, compile_options), None)
+
+
 class KernelContainer(object):
     """Those object holds a copy of all kernels accessible as attributes"""
 
@@ -144,6 +184,7 @@ class OpenclProcessing(object):
         self.set_profiling(profile)
         self.block_size = block_size
         self.program = None
+        self.program_key = None
         self.kernels = None
 
     def check_textures_availability(self):
@@ -154,6 +195,8 @@ class OpenclProcessing(object):
         """
         try:
             self.reset_log()
+            # The program stays cached for other instances, until the context is released
+            self.program_key = None
             self.free_kernels()
             self.free_buffers()
             if self.queue is not None:
@@ -264,7 +307,8 @@ class OpenclProcessing(object):
         compile_options = compile_options or self.get_compiler_options()
         logger.info("Compiling file %s with options %s", kernel_files, compile_options)
         try:
-            self.program = pyopencl.Program(self.ctx, kernel_src).build(options=compile_options)
+            self.program = _build_program(self.ctx, kernel_src, compile_options)
+            self.program_key = (kernel_src, compile_options)
         except (pyopencl.MemoryError, pyopencl.LogicError) as error:
             raise MemoryError(error)
         else:
@@ -277,6 +321,9 @@ class OpenclProcessing(object):
             self.cl_kernel_args[kernel] = []
         self.kernels = None
         self.program = None
+        if self.program_key is not None:
+            _release_program(self.ctx, *self.program_key)
+            self.program_key = None
 
     def set_profiling(self, value=True):
         """Switch On/Off the profiling flag of the command queue to allow debugging
@@ -24,7 +24,7 @@
 
 __authors__ = ["J. Kieffer"]
 __license__ = "MIT"
-__date__ = "11/01/2019"
+__date__ = "15/10/2026"
 
 import os
 import unittest
@@ -40,6 +40,7 @@ from . import test_kahan
 from . import test_stats
 from . import test_convolution
 from . import test_sparse
+from . import test_processing
 
 
 def suite():
@@ -56,6 +57,7 @@ def suite():
     test_suite.addTests(test_stats.suite())
     test_suite.addTests(test_convolution.suite())
     test_suite.addTests(test_sparse.suite())
+    test_suite.addTests(test_processing.suite())
     # Allow to remove sift from the project
     test_base_dir = os.path.dirname(__file__)
     sift_dir = os.path.join(test_base_dir, "..", "sift")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/silx-kit/silx
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Test of the cache of built programs of OpenclProcessing
+"""
+
+from __future__ import division, print_function
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "MIT"
+__copyright__ = "2013 European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "15/10/2026"
+
+import gc
+import weakref
+import unittest
+from ..common import ocl
+if ocl:
+    import pyopencl
+from .. import processing
+
+
+class Addition(processing.OpenclProcessing):
+    """Minimal OpenclProcessing compiling the addition kernel"""
+    kernel_files = ["addition"]
+
+    def __init__(self, ctx):
+        processing.OpenclProcessing.__init__(self, ctx=ctx)
+        self.compile_kernels()
+
+
+@unittest.skipUnless(ocl, "PyOpenCl is missing")
+class TestProgramCache(unittest.TestCase):
+
+    def test_shared(self):
+        """Programs are built once per context"""
+        ctx = ocl.create_context(cached=False)
+        first = Addition(ctx)
+        second = Addition(ctx)
+        self.assertEqual(first.program.int_ptr, second.program.int_ptr)
+        first.free_kernels()
+        self.assertEqual(len(processing._programs[ctx]), 0)
+        third = Addition(ctx)
+        self.assertNotEqual(third.program.int_ptr, second.program.int_ptr)
+
+    def test_release_context(self):
+        """The cache does not keep the context alive"""
+        ctx = pyopencl.Context(devices=ocl.create_context().devices)
+        ref = weakref.ref(ctx)
+        Addition(ctx)
+        del ctx
+        gc.collect()
+        self.assertIsNone(ref())
+
+
+def suite():
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(TestProgramCache("test_shared"))
+    test_suite.addTest(TestProgramCache("test_release_context"))
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest="suite")
@@ -29,110 +29,131 @@
  */
 
 /* To decompress CBF byte-offset compressed in parallel on GPU one needs to:
- * - Set all values in mask and exception counter to zero.
+ * - Set the exception counter and the mask to zero.
  * - Mark regions with exceptions and set values without exception.
  *   This generates the values (zeros for exceptions), the exception mask,
  *   counts the number of exception region and provides a start position for
  *   each exception.
- * - Treat exceptions. For this, one thread in a workgoup treats a complete
- *   masked region in a serial fashion. All regions are treated in parallel.
+ * - Treat exceptions. For this, a group of LANES work-items treats a complete
+ *   masked region cooperatively. All regions are treated in parallel by a
+ *   fixed number of workgroups which read the number of exceptions on the
+ *   device.
  *   Values written at this stage are marked in the mask with -1.
  * - Double scan: inclusive cum sum for values, exclusive cum sum to generate
  *   indices in output array. Values with mask = 1 are considered as 0.
  * - Compact and copy output by removing duplicated values in exceptions.
  */
 
+// With non-uniform workgroups (OpenCL >= 2.0), element-wise kernels are
+// launched with the exact size of the stream and need no bound check.
+#ifdef EXACT_ND_RANGE
+#define OUT_OF_RANGE(gid, size) 0
+#else
+#define OUT_OF_RANGE(gid, size) ((gid) >= (size))
+#endif
+
+// The mask has to be set to zero beforehand: each exception marks the bytes
+// it covers. Marking them backward from each byte, without memset, is slower.
 kernel void mark_exceptions(global char* raw,
                             int size,
-                            int full_size,
                             global int* mask,
                             global int* values,
                             global int* cnt,
                             global int* exc)
 {
-    int gid;
+    int gid, value, position, maxi;
     gid = get_global_id(0);
-    if (gid<size)
+    if (OUT_OF_RANGE(gid, size))
+        return;
+    value = raw[gid];
+    if (value == -128)
     {
-        int value, position;
-        value = raw[gid];
-        if (value == -128)
-        {
-            int maxi;
-            values[gid] = 0;
-            position = atomic_inc(cnt);
-            exc[position] = gid;
-            maxi = size - 1;
-            mask[gid] = 1;
-            mask[min(maxi, gid+1)] = 1;
-            mask[min(maxi, gid+2)] = 1;
+        values[gid] = 0;
+        position = atomic_inc(cnt);
+        exc[position] = gid;
+        maxi = size - 1;
+        mask[gid] = 1;
+        mask[min(maxi, gid+1)] = 1;
+        mask[min(maxi, gid+2)] = 1;
 
-            if (((int) raw[min(gid+1, maxi)] == 0) &&
-                ((int) raw[min(gid+2, maxi)] == -128))
-            {
-                mask[min(maxi, gid+3)] = 1;
-                mask[min(maxi, gid+4)] = 1;
-                mask[min(maxi, gid+5)] = 1;
-                mask[min(maxi, gid+6)] = 1;
-            }
+        if (((int) raw[min(gid+1, maxi)] == 0) &&
+            ((int) raw[min(gid+2, maxi)] == -128))
+        {
+            mask[min(maxi, gid+3)] = 1;
+            mask[min(maxi, gid+4)] = 1;
+            mask[min(maxi, gid+5)] = 1;
+            mask[min(maxi, gid+6)] = 1;
         }
-        else
-        { // treat simple data
+    }
+    else
+    { // treat simple data
+        values[gid] = value;
+    }
+}
 
-            values[gid] = value;
+// Decode the token (1, 3 or 7 bytes) starting at position pos of the stream.
+// Returns the width of the token and stores the decoded value in value.
+static inline int decode_token(global char* raw,
+                               int pos,
+                               int maxi,
+                               int* value)
+{
+    int first = (int) raw[pos];
+    if (first == -128)
+    { // this correspond to 16 bits exception
+        uchar low_byte = raw[min(pos+1, maxi)];
+        char high_byte = raw[min(pos+2, maxi)];
+        int next_value = high_byte<<8 | low_byte;
+        if (next_value == -32768)
+        { // this correspond to 32 bits exception
+            uchar low_byte1 = raw[min(pos+3, maxi)],
+                  low_byte2 = raw[min(pos+4, maxi)],
+                  low_byte3 = raw[min(pos+5, maxi)];
+            char high_byte4 = raw[min(pos+6, maxi)];
+            *value = high_byte4<<24 | low_byte3<<16 | low_byte2<<8 | low_byte1;
+            return 7;
         }
+        *value = next_value;
+        return 3;
     }
-    else if (gid<full_size)
-    {
-        mask[gid]=1;
-        values[gid] = 0;
-    }
+    *value = first;
+    return 1;
 }
 
-//run with WG=1, as may as exceptions
-kernel void treat_exceptions(global char* raw,  //raw compressed stream
-                             int size,          //size of the raw compressed stream
-                             global int* mask,  //tells if the value is masked
-                             global int* exc,   //array storing the position of the start of exception zones
-                             global int* values)// stores decompressed values.
+// Persistent workgroups: a fixed number of workgroups loops over all exceptions.
+// The number of exceptions is read from the device so no host round-trip is needed.
+// Each masked region is treated by a group of LANES work-items and a workgroup
+// treats WG/LANES regions at once. The position of a token depends on the width
+// of all previous ones, so every lane decodes the whole chain of tokens of the
+// region: lanes only share the writes, at their own offset (modulo LANES), and
+// no barrier is needed.
+kernel __attribute__((reqd_work_group_size(WG, 1, 1)))
+void treat_exceptions(global char* raw,  //raw compressed stream
+                      int size,          //size of the raw compressed stream
+                      global int* mask,  //tells if the value is masked
+                      global int* exc,   //array storing the position of the start of exception zones
+                      global int* values,// stores decompressed values.
+                      global int* cnt)   //number of exceptions, as counted by mark_exceptions
 {
-    int gid = get_global_id(0);
-    int inp_pos = exc[gid];
-    if ((inp_pos<=0) || ((int)mask[inp_pos - 1] == 0))
+    int lane = get_local_id(0) % LANES;
+    int nb_exc = cnt[0];
+    for (int idx=get_global_id(0) / LANES; idx<nb_exc; idx+=get_global_size(0) / LANES)
     {
-        int value, is_masked, next_value, inc;
-        is_masked = (mask[inp_pos] != 0);
-        while ((is_masked) && (inp_pos<size))
+        int start = exc[idx];
+        // Only the start of a masked region is treated
+        if ((start > 0) && ((int)mask[start - 1] != 0))
+            continue;
+        int pos = start;
+        while ((pos < size) && (mask[pos] != 0))
         {
-            value = (int) raw[inp_pos];
-            if (value == -128)
-            { // this correspond to 16 bits exception
-                uchar low_byte = raw[inp_pos+1];
-                char high_byte = raw[inp_pos+2] ;
-                next_value = high_byte<<8 | low_byte;
-                if (next_value == -32768)
-                { // this correspond to 32 bits exception
-                    uchar low_byte1 = raw[inp_pos+3],
-                          low_byte2 = raw[inp_pos+4],
-                          low_byte3 = raw[inp_pos+5];
-                    char high_byte4 = raw[inp_pos+6] ;
-                    value = high_byte4<<24 | low_byte3<<16 | low_byte2<<8 | low_byte1;
-                    inc = 7;
-                }
-                else
-                {
-                    value = next_value;
-                    inc = 3;
-                }
-            }
-            else
+            int value;
+            int width = decode_token(raw, pos, size - 1, &value);
+            if ((pos - start) % LANES == lane)
             {
-                inc = 1;
+                values[pos] = value;
+                mask[pos] = -1; // mark the processed data as valid in the mask
             }
-            values[inp_pos] = value;
-            mask[inp_pos] = -1; // mark the processed data as valid in the mask
-            inp_pos += inc;
-            is_masked = (mask[inp_pos] != 0);
+            pos += width;
         }
     }
 }
@@ -146,15 +167,14 @@ kernel void copy_result_int(global int* values,
                             )
 {
     int gid = get_global_id(0);
-    if (gid < in_size)
+    if (OUT_OF_RANGE(gid, in_size))
+        return;
+    int current = max(indexes[gid], 0),
+           next = (gid >= (in_size - 1)) ? in_size + 1 : indexes[gid + 1];
+    //we keep always the last element
+    if ((current < out_size) && (current < next))
     {
-        int current = max(indexes[gid], 0),
-               next = (gid >= (in_size - 1)) ? in_size + 1 : indexes[gid + 1];
-        //we keep always the last element
-        if ((current <= out_size) && (current < next))
-        {
-            output[current] = values[gid];
-        }
+        output[current] = values[gid];
     }
 }
 
@@ -167,46 +187,95 @@ kernel void copy_result_float(global int* values,
                               )
 {
     int gid = get_global_id(0);
-    if (gid<in_size)
+    if (OUT_OF_RANGE(gid, in_size))
+        return;
+    int current = max(indexes[gid], 0),
+           next = (gid >= (in_size - 1)) ? in_size + 1 : indexes[gid + 1];
+    if ((current < out_size) && (current < next))
     {
-        int current = max(indexes[gid], 0),
-               next = (gid >= (in_size - 1)) ? in_size + 1 : indexes[gid + 1];
-        if ((current < out_size) && (current < next))
-        {
-            output[current] = (float) values[gid];
-        }
+        output[current] = (float) values[gid];
     }
 }
 
 
-// combined memset for all arrays used for Byte Offset decompression
-kernel void byte_offset_memset(global char* raw,
-                               global int* mask,
-                               global int* index,
-                               global int* result,
-                               int full_size,
-                               int actual_size
-                              )
+// Index of the frame containing the position gid of the concatenated stream.
+// offsets has nb_frames+1 elements: start of each frame and total size.
+static inline int find_frame(global int* offsets,
+                             int nb_frames,
+                             int gid)
+{
+    int lower = 0, upper = nb_frames;
+    while (upper - lower > 1)
+    {
+        int middle = (lower + upper) >> 1;
+        if (offsets[middle] <= gid)
+            lower = middle;
+        else
+            upper = middle;
+    }
+    return lower;
+}
+
+// copy the values of the elements of several concatenated frames to their
+// definitive position. Values and indexes of a frame are shifted by those
+// at the end of the previous frame.
+kernel void copy_result_batch_int(global int* values,
+                                  global int* indexes,
+                                  int in_size,
+                                  int out_size,
+                                  global int* offsets,
+                                  int nb_frames,
+                                  global int* output
+                                  )
 {
     int gid = get_global_id(0);
-    if (gid < full_size)
+    if (OUT_OF_RANGE(gid, in_size))
+        return;
+    int frame = find_frame(offsets, nb_frames, gid),
+          start = offsets[frame],
+           base = (start > 0) ? values[start - 1] : 0,
+        current = max(indexes[gid], 0),
+           next = (gid >= (in_size - 1)) ? in_size + 1 : indexes[gid + 1];
+    if (current < next)
     {
-        raw[gid] = 0;
-        index[gid] = 0;
-        result[gid] = 0;
-        if (gid<actual_size)
+        current -= max(indexes[start], 0);
+        if (current < out_size)
         {
-            mask[gid] = 0;
+            output[frame * out_size + current] = values[gid] - base;
         }
-        else
+    }
+}
+
+// copy the values of the elements of several concatenated frames to their
+// definitive position. Values and indexes of a frame are shifted by those
+// at the end of the previous frame.
+kernel void copy_result_batch_float(global int* values,
+                                    global int* indexes,
+                                    int in_size,
+                                    int out_size,
+                                    global int* offsets,
+                                    int nb_frames,
+                                    global float* output
+                                    )
+{
+    int gid = get_global_id(0);
+    if (OUT_OF_RANGE(gid, in_size))
+        return;
+    int frame = find_frame(offsets, nb_frames, gid),
+          start = offsets[frame],
+           base = (start > 0) ? values[start - 1] : 0,
+        current = max(indexes[gid], 0),
+           next = (gid >= (in_size - 1)) ? in_size + 1 : indexes[gid + 1];
+    if (current < next)
+    {
+        current -= max(indexes[start], 0);
+        if (current < out_size)
         {
-            mask[gid] = 1;
+            output[frame * out_size + current] = (float) (values[gid] - base);
         }
-
     }
 }
 
-
 //Simple memset kernel for char arrays
 kernel void fill_char_mem(global char* ary,
                           int size,